@@ -1,10 +1,21 @@
 # llm_clients.py
 from __future__ import annotations
 
+import asyncio
+import copy
+import hashlib
 import json
 import shutil
-from dataclasses import dataclass
-from typing import Any, Dict, Optional
+import sqlite3
+import time
+import warnings
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Optional
+
+try:
+    from orjson import loads as _loads  # type: ignore
+except ImportError:  # stdlib fallback; same results for model-sized payloads
+    from json import loads as _loads
 
 
 @dataclass
@@ -12,82 +23,460 @@ class LLMResult:
     ok: bool
     data: Optional[Dict[str, Any]] = None
     error: Optional[str] = None
+    items: Optional[List[Optional[Dict[str, Any]]]] = None
 
 
 class BaseLLMClient:
-    def generate(self, prompt: str, max_new_tokens: int = 768) -> LLMResult:
+    # Upper bound on requests agenerate_many keeps in flight at once.
+    max_concurrency: int = 4
+
+    def __init__(self) -> None:
+        self._prompt_prefix: Optional[str] = None
+
+    def set_prompt_prefix(self, prefix: str) -> None:
+        """
+        Declare the text every upcoming prompt starts with, so backends can reuse its prefill.
+        """
+        self._prompt_prefix = prefix
+
+    def _complete(self, prompt: str, max_new_tokens: int) -> str:
+        """
+        Return the raw model output for ``prompt``. Raise on failure.
+        """
         raise NotImplementedError
 
+    def generate(self, prompt: str, max_new_tokens: int = 768) -> LLMResult:
+        try:
+            text = self._complete(prompt, max_new_tokens)
+        except Exception as e:
+            return LLMResult(False, error=str(e))
+        return _extract_json_block(text)
+
+    def generate_array(self, prompt: str, max_new_tokens: int = 768) -> LLMResult:
+        """
+        Generate once and parse a top-level JSON array of objects into ``items``.
+        """
+        try:
+            text = self._complete(prompt, max_new_tokens)
+        except Exception as e:
+            return LLMResult(False, error=str(e))
+        return _extract_json_array(text)
+
+    def generate_many(self, prompts: List[str], max_new_tokens: int = 768) -> List[LLMResult]:
+        """
+        Generate one JSON object per prompt. Backends that can batch should override this.
+        """
+        return [self.generate(p, max_new_tokens) for p in prompts]
+
+    async def _acomplete(self, prompt: str, max_new_tokens: int) -> str:
+        """
+        Async ``_complete``. Runs the blocking call in a worker thread unless overridden.
+        """
+        return await asyncio.to_thread(self._complete, prompt, max_new_tokens)
+
+    async def agenerate(self, prompt: str, max_new_tokens: int = 768) -> LLMResult:
+        try:
+            text = await self._acomplete(prompt, max_new_tokens)
+        except Exception as e:
+            return LLMResult(False, error=str(e))
+        return _extract_json_block(text)
+
+    async def agenerate_many(self, prompts: List[str], max_new_tokens: int = 768) -> List[LLMResult]:
+        """
+        Async ``generate_many``: the prompts are issued concurrently, at most
+        ``max_concurrency`` at a time.
+        """
+        sem = asyncio.Semaphore(self.max_concurrency)
+
+        async def one(prompt: str) -> LLMResult:
+            async with sem:
+                return await self.agenerate(prompt, max_new_tokens)
+
+        return list(await asyncio.gather(*[one(p) for p in prompts]))
+
+    async def aclose(self) -> None:
+        """
+        Release resources held for async requests.
+        """
+
 
 def _extract_json_block(text: str) -> LLMResult:
     """
     Extract the first JSON object from the text and parse it.
     """
+    try:
+        data = _loads(text)
+        if isinstance(data, dict):
+            return LLMResult(True, data=data)
+    except ValueError:
+        pass
     try:
         start = text.find("{")
         end = text.rfind("}")
         if start != -1 and end != -1 and end > start:
             payload = text[start : end + 1]
-            data = json.loads(payload)
+            data = _loads(payload)
             return LLMResult(True, data=data)
         return LLMResult(False, error="No JSON object found in model output")
     except Exception as e:
         return LLMResult(False, error=f"JSON parse failed: {e}")
 
 
+def _extract_json_array(text: str) -> LLMResult:
+    """
+    Extract the objects of the first JSON array in the text.
+
+    Each top-level object is parsed on its own (bracket-depth scan, string aware),
+    so a truncated array still yields the items that were completed. An object
+    that fails to parse is kept as ``None`` so later items keep their position.
+    """
+    start = text.find("[")
+    if start == -1:
+        return LLMResult(False, error="No JSON array found in model output")
+    items: List[Optional[Dict[str, Any]]] = []
+    depth = 0
+    obj_start = -1
+    in_str = False
+    escaped = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_str:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_str = False
+            continue
+        if ch == '"':
+            in_str = True
+        elif ch in "[{":
+            if ch == "{" and depth == 1:
+                obj_start = i
+            depth += 1
+        elif ch in "]}":
+            depth -= 1
+            if ch == "}" and depth == 1 and obj_start != -1:
+                try:
+                    item = _loads(text[obj_start : i + 1])
+                except Exception:
+                    item = None
+                items.append(item if isinstance(item, dict) else None)
+                obj_start = -1
+            if depth == 0:
+                break
+    if not any(items):
+        return LLMResult(False, error="No JSON objects found in model output array")
+    return LLMResult(True, items=items)
+
+
 class HFClient(BaseLLMClient):
     """
-    Hugging Face Transformers local pipeline client (free, local).
+    Hugging Face Transformers local model client (free, local).
+
+    Loads the model directly in half precision (bf16 where supported) with
+    FlashAttention-2 when installed, and compiles the forward pass.
     """
 
     def __init__(self, model: str = "mistralai/Mistral-7B-Instruct-v0.2", **gen_kwargs: Any) -> None:
+        super().__init__()
         self.model = model
         self.gen_kwargs = {"max_new_tokens": 700, "temperature": 0.5, "top_p": 0.9, **gen_kwargs}
         try:
-            from transformers import pipeline  # type: ignore
-            self._pipeline = pipeline(
-                task="text-generation",
-                model=self.model,
-                tokenizer=self.model,
+            import importlib.util
+
+            import torch  # type: ignore
+            from transformers import AutoModelForCausalLM, AutoTokenizer  # type: ignore
+
+            if torch.cuda.is_available():
+                dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+            else:
+                dtype = torch.float32
+            attn = "flash_attention_2" if importlib.util.find_spec("flash_attn") else "sdpa"
+
+            self._tokenizer = AutoTokenizer.from_pretrained(self.model, padding_side="left")
+            if self._tokenizer.pad_token is None:
+                self._tokenizer.pad_token = self._tokenizer.eos_token
+            self._model = AutoModelForCausalLM.from_pretrained(
+                self.model,
+                torch_dtype=dtype,
                 device_map="auto",
+                attn_implementation=attn,
             )
+            self._model.eval()
+            # Compile forward only: generate() stays the eager HF loop and calls it.
+            # Default mode, not "reduce-overhead": the dynamic KV cache grows every
+            # decode step, which would re-record CUDA graphs per shape.
+            self._eager_forward = self._model.forward
+            self._compiled_forward: Any = torch.compile(self._eager_forward, dynamic=True)
+            self._model.forward = self._forward
+            self._torch = torch
+            self._prefix_ids: Any = None
+            self._prefix_kv: Any = None
             self._ok = True
             self._import_error = None
         except Exception as e:
-            self._pipeline = None
+            self._model = None
             self._ok = False
             self._import_error = str(e)
 
-    def generate(self, prompt: str, max_new_tokens: int = 768) -> LLMResult:
-        if not self._ok or self._pipeline is None:
-            return LLMResult(False, error=f"Transformers pipeline not available: {self._import_error}")
+    def _forward(self, *args: Any, **kwargs: Any) -> Any:
+        """
+        Compiled forward, switching to eager for good if compilation fails
+        (e.g. no C++ toolchain) instead of failing every generation.
+        """
+        if self._compiled_forward is not None:
+            try:
+                return self._compiled_forward(*args, **kwargs)
+            except Exception as e:
+                warnings.warn(f"torch.compile failed, using eager forward: {e}", RuntimeWarning)
+                self._compiled_forward = None
+        return self._eager_forward(*args, **kwargs)
+
+    def _complete(self, prompt: str, max_new_tokens: int) -> str:
+        return self._complete_batch([prompt], max_new_tokens)[0]
+
+    def set_prompt_prefix(self, prefix: str) -> None:
+        super().set_prompt_prefix(prefix)
+        self._prefix_ids = None
+        self._prefix_kv = None
+
+    def _prefix_cache(self, input_ids: Any) -> Any:
+        """
+        Return a fresh copy of the KV cache for the declared prompt prefix when
+        ``input_ids`` (a single prompt) starts with its tokens, else None.
+        """
+        if self._prompt_prefix is None or input_ids.shape[0] != 1:
+            return None
+        if self._prefix_kv is None:
+            from transformers import DynamicCache  # type: ignore
+            prefix = self._tokenizer(self._prompt_prefix, return_tensors="pt").to(self._model.device)
+            with self._torch.inference_mode():
+                out = self._model(**prefix, past_key_values=DynamicCache(), use_cache=True)
+            self._prefix_ids = prefix["input_ids"]
+            self._prefix_kv = out.past_key_values
+        n = self._prefix_ids.shape[1]
+        if input_ids.shape[1] <= n or not self._torch.equal(input_ids[:, :n], self._prefix_ids):
+            return None
+        return copy.deepcopy(self._prefix_kv)
+
+    def _complete_batch(self, prompts: List[str], max_new_tokens: int) -> List[str]:
+        if not self._ok or self._model is None:
+            raise RuntimeError(f"Transformers model not available: {self._import_error}")
+        inputs = self._tokenizer(prompts, return_tensors="pt", padding=True).to(self._model.device)
+        extra: Dict[str, Any] = {}
+        prefix_kv = self._prefix_cache(inputs["input_ids"])
+        if prefix_kv is not None:
+            # generate() only prefills the tokens past the cached prefix.
+            extra["past_key_values"] = prefix_kv
+        with self._torch.inference_mode():
+            out = self._model.generate(
+                **inputs,
+                **{
+                    "do_sample": True,
+                    "use_cache": True,
+                    "pad_token_id": self._tokenizer.pad_token_id,
+                    **self.gen_kwargs,
+                    "max_new_tokens": max_new_tokens,
+                },
+                **extra,
+            )
+        # Left padding aligns every prompt to the same length; keep only new tokens.
+        return self._tokenizer.batch_decode(out[:, inputs["input_ids"].shape[1]:], skip_special_tokens=True)
+
+    def generate_many(self, prompts: List[str], max_new_tokens: int = 768) -> List[LLMResult]:
         try:
-            out = self._pipeline(prompt, **{**self.gen_kwargs, "max_new_tokens": max_new_tokens})
-            text = out[0]["generated_text"]
-            return _extract_json_block(text)
+            texts = self._complete_batch(prompts, max_new_tokens)
         except Exception as e:
-            return LLMResult(False, error=str(e))
+            return [LLMResult(False, error=str(e)) for _ in prompts]
+        return [_extract_json_block(t) for t in texts]
 
 
 class OllamaClient(BaseLLMClient):
     """
-    Ollama client via subprocess (free, local).
+    Ollama client via the local HTTP API (free, local).
+
+    Requests ask the server to keep the model loaded between calls, so only the
+    first question pays the model-load cost. Falls back to ``ollama run`` via
+    subprocess when the API is unreachable. ``num_parallel`` should match the
+    server's OLLAMA_NUM_PARALLEL so concurrent requests do not queue past the timeout.
     """
 
-    def __init__(self, model: str = "mistral:7b") -> None:
+    def __init__(self, model: str = "mistral:7b", host: str = "http://localhost:11434",
+                 keep_alive: str = "30m", num_parallel: int = 4) -> None:
+        super().__init__()
+        if num_parallel < 1:
+            raise ValueError(f"num_parallel must be at least 1, got {num_parallel}")
         self.model = model
+        self.max_concurrency = num_parallel
+        self.host = host.rstrip("/")
+        self.keep_alive = keep_alive
         self._have_ollama = shutil.which("ollama") is not None
+        self._session: Any = None
+        self._async_session: Any = None
+        self._async_loop: Any = None
 
-    def generate(self, prompt: str, max_new_tokens: int = 768) -> LLMResult:
-        if not self._have_ollama:
-            return LLMResult(False, error="ollama binary not found on PATH")
+    def _payload(self, prompt: str, max_new_tokens: int) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "prompt": prompt,
+            "stream": False,
+            "keep_alive": self.keep_alive,
+            "options": {"num_predict": max_new_tokens},
+        }
+
+    def _complete(self, prompt: str, max_new_tokens: int) -> str:
         try:
-            import subprocess
-            cmd = ["ollama", "run", self.model]
-            proc = subprocess.run(cmd, input=prompt.encode("utf-8"), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            if proc.returncode != 0:
-                return LLMResult(False, error=proc.stderr.decode("utf-8", "ignore"))
-            text = proc.stdout.decode("utf-8", "ignore")
-            return _extract_json_block(text)
+            return self._complete_http(prompt, max_new_tokens)
         except Exception as e:
-            return LLMResult(False, error=str(e))
+            if not self._have_ollama:
+                raise RuntimeError(f"Ollama API request failed ({e}) and ollama binary not found on PATH")
+            return self._complete_subprocess(prompt)
+
+    def _complete_http(self, prompt: str, max_new_tokens: int) -> str:
+        if self._session is None:
+            import requests
+            self._session = requests.Session()
+        resp = self._session.post(f"{self.host}/api/generate", json=self._payload(prompt, max_new_tokens), timeout=600)
+        resp.raise_for_status()
+        return _loads(resp.content)["response"]
+
+    async def _acomplete(self, prompt: str, max_new_tokens: int) -> str:
+        try:
+            return await self._acomplete_http(prompt, max_new_tokens)
+        except Exception as e:
+            if not self._have_ollama:
+                raise RuntimeError(f"Ollama API request failed ({e}) and ollama binary not found on PATH")
+            return await asyncio.to_thread(self._complete_subprocess, prompt)
+
+    async def _acomplete_http(self, prompt: str, max_new_tokens: int) -> str:
+        # An AsyncClient is tied to the event loop it was first used on.
+        loop = asyncio.get_running_loop()
+        if self._async_session is None or self._async_loop is not loop:
+            import httpx
+            self._async_session = httpx.AsyncClient(base_url=self.host, timeout=600)
+            self._async_loop = loop
+        resp = await self._async_session.post("/api/generate", json=self._payload(prompt, max_new_tokens))
+        resp.raise_for_status()
+        return _loads(resp.content)["response"]
+
+    async def aclose(self) -> None:
+        if self._async_session is not None:
+            await self._async_session.aclose()
+            self._async_session = None
+            self._async_loop = None
+
+    def _complete_subprocess(self, prompt: str) -> str:
+        import subprocess
+        cmd = ["ollama", "run", self.model]
+        proc = subprocess.run(cmd, input=prompt.encode("utf-8"), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if proc.returncode != 0:
+            raise RuntimeError(proc.stderr.decode("utf-8", "ignore"))
+        return proc.stdout.decode("utf-8", "ignore")
+
+
+class CachingLLMClient(BaseLLMClient):
+    """
+    Wraps another client and memoizes successful results in a local SQLite file,
+    keyed by model, prompt, token budget and temperature. Entries expire after ``ttl`` seconds.
+
+    A prompt repeated within one batch call gets one key per occurrence, so the
+    repeats come back as distinct answers rather than one cached answer copied.
+    """
+
+    def __init__(self, inner: BaseLLMClient, path: str = ".llm_cache.sqlite3", ttl: int = 7 * 24 * 3600) -> None:
+        super().__init__()
+        self.inner = inner
+        self.ttl = ttl
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, result BLOB, ts INT)")
+        self._db.commit()
+
+    def set_prompt_prefix(self, prefix: str) -> None:
+        super().set_prompt_prefix(prefix)
+        self.inner.set_prompt_prefix(prefix)
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
+
+    def _key(self, kind: str, prompt: str, max_new_tokens: int, occurrence: int = 0) -> str:
+        gen_kwargs = getattr(self.inner, "gen_kwargs", {})
+        raw = json.dumps({
+            "k": kind,
+            "m": getattr(self.inner, "model", type(self.inner).__name__),
+            "p": prompt,
+            "n": max_new_tokens,
+            "t": gen_kwargs.get("temperature"),
+            "o": occurrence,
+        }, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _batch_keys(self, prompts: List[str], max_new_tokens: int) -> List[str]:
+        seen: Dict[str, int] = {}
+        keys: List[str] = []
+        for p in prompts:
+            occurrence = seen.get(p, 0)
+            seen[p] = occurrence + 1
+            keys.append(self._key("object", p, max_new_tokens, occurrence))
+        return keys
+
+    def _get(self, key: str) -> Optional[LLMResult]:
+        row = self._db.execute("SELECT result, ts FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None or time.time() - row[1] > self.ttl:
+            return None
+        return LLMResult(**_loads(row[0]))
+
+    def _put(self, key: str, result: LLMResult) -> None:
+        if not result.ok:
+            return
+        self._db.execute(
+            "INSERT OR REPLACE INTO cache (key, result, ts) VALUES (?, ?, ?)",
+            (key, json.dumps(asdict(result)).encode("utf-8"), int(time.time())),
+        )
+        self._db.commit()
+
+    def generate(self, prompt: str, max_new_tokens: int = 768) -> LLMResult:
+        key = self._key("object", prompt, max_new_tokens)
+        result = self._get(key)
+        if result is None:
+            result = self.inner.generate(prompt, max_new_tokens)
+            self._put(key, result)
+        return result
+
+    def generate_array(self, prompt: str, max_new_tokens: int = 768) -> LLMResult:
+        key = self._key("array", prompt, max_new_tokens)
+        result = self._get(key)
+        if result is None:
+            result = self.inner.generate_array(prompt, max_new_tokens)
+            self._put(key, result)
+        return result
+
+    async def agenerate(self, prompt: str, max_new_tokens: int = 768) -> LLMResult:
+        key = self._key("object", prompt, max_new_tokens)
+        result = self._get(key)
+        if result is None:
+            result = await self.inner.agenerate(prompt, max_new_tokens)
+            self._put(key, result)
+        return result
+
+    def generate_many(self, prompts: List[str], max_new_tokens: int = 768) -> List[LLMResult]:
+        keys = self._batch_keys(prompts, max_new_tokens)
+        results: List[Optional[LLMResult]] = [self._get(k) for k in keys]
+        missing = [i for i, r in enumerate(results) if r is None]
+        if missing:
+            fresh = self.inner.generate_many([prompts[i] for i in missing], max_new_tokens)
+            for i, res in zip(missing, fresh):
+                self._put(keys[i], res)
+                results[i] = res
+        return results  # type: ignore[return-value]
+
+    async def agenerate_many(self, prompts: List[str], max_new_tokens: int = 768) -> List[LLMResult]:
+        keys = self._batch_keys(prompts, max_new_tokens)
+        results: List[Optional[LLMResult]] = [self._get(k) for k in keys]
+        missing = [i for i, r in enumerate(results) if r is None]
+        if missing:
+            fresh = await self.inner.agenerate_many([prompts[i] for i in missing], max_new_tokens)
+            for i, res in zip(missing, fresh):
+                self._put(keys[i], res)
+                results[i] = res
+        return results  # type: ignore[return-value]
@@ -2,12 +2,9 @@
 from __future__ import annotations
 
 import random
-import re
+import threading
 from typing import Any, Dict, List, Optional, Tuple
-
-import matplotlib.pyplot as plt
-from docx import Document
-from docx.shared import Inches
+from xml.sax.saxutils import escape
 
 from llm_clients import BaseLLMClient, LLMResult
 
@@ -16,48 +13,151 @@ from llm_clients import BaseLLMClient, LLMResult
 # Utilities
 # ------------------------------
 
+# Control chars that are illegal in XML (tab, LF and CR are kept).
+_CTRL_TABLE = {c: None for c in [*range(0, 9), 11, 12, *range(14, 32)]}
+
+
 def clean_text(text: str) -> str:
     """Remove illegal XML/control chars for Word compatibility."""
     if not text:
         return ""
-    return re.sub(r"[\x00-\x08\x0B-\x0C\x0E-\x1F]", "", str(text))
+    return str(text).translate(_CTRL_TABLE)
+
+
+# Inside a <w:t>, close the text element around line breaks and tabs the way
+# python-docx's run.text setter does (one <w:br/> per CR or LF).
+_BREAK_TABLE = {
+    ord("\n"): '</w:t><w:br/><w:t xml:space="preserve">',
+    ord("\r"): '</w:t><w:br/><w:t xml:space="preserve">',
+    ord("\t"): '</w:t><w:tab/><w:t xml:space="preserve">',
+}
+
+
+def _xml_text(text: str) -> str:
+    """clean_text plus XML escaping, for splicing into the <w:t> of WordprocessingML templates."""
+    return escape(clean_text(text)).translate(_BREAK_TABLE)
+
+
+# Fallback question text; only the randomized slots are filled per call.
+_CIRCLE_Q = "A circle has a radius of {r} units. What is the area of the circle?"
+_CIRCLE_EXPL = "Area formula: $A=\\pi r^2$. With $r={r}$, $A=\\pi\\cdot {r}^2={area}\\pi$ square units."
+_QUADRATIC_Q = "If {eq}, what are all possible values of $x$?"
+_QUADRATIC_EXPL = "Factor: $(x-{a})(x-{b})=0$ so $x={a}$ or $x={b}$."
+_COORD_Q = "Which point on the coordinate plane has an $x$-coordinate of {x}?"
+_COORD_EXPL = "Point {letter} is at $({x}, {y})$ so its $x$-coordinate is {x}."
+_FRACTION_Q = "In a group of {total} students, {pct}% are {category}. How many students are {category}?"
+_FRACTION_EXPL = "Compute {pct}% of {total}: $\\frac{{{pct}}}{{100}}\\times {total}={answer}$."
+_LINEAR_Q = "If {expr}, what is the value of $x$?"
+_LINEAR_EXPL = "${a}x-{c}x={d}-{b}$ so ${k}x={rhs}$, hence $x={x}$."
+
+_CAIROSVG: Any = None
+_CAIROSVG_CHECKED = False
+_CAIROSVG_LOCK = threading.Lock()
+
+
+def _load_cairosvg() -> Any:
+    """Import cairosvg once, thread-safely; None when it or the native cairo library is missing."""
+    global _CAIROSVG, _CAIROSVG_CHECKED
+    with _CAIROSVG_LOCK:
+        if not _CAIROSVG_CHECKED:
+            try:
+                import cairosvg  # type: ignore
+                _CAIROSVG = cairosvg
+            except (ImportError, OSError):
+                _CAIROSVG = None
+            _CAIROSVG_CHECKED = True
+    return _CAIROSVG
+
+
+_POINT_COLORS = ("#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd")
+
+
+def _render_coord_svg(points_data: Dict[str, Tuple[int, int]], size: int = 600) -> bytes:
+    """Draw labelled points on a [-6, 6] coordinate plane as a standalone SVG document."""
+    pad = 48
+    unit = (size - 2 * pad) / 12
+    lo, hi = pad, size - pad
+
+    def px(v: float) -> float:
+        return pad + (v + 6) * unit
+
+    def py(v: float) -> float:
+        return pad + (6 - v) * unit
+
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{size}" height="{size}" '
+        f'viewBox="0 0 {size} {size}" font-family="DejaVu Sans, Arial, sans-serif" font-size="13">',
+        f'<rect width="{size}" height="{size}" fill="white"/>',
+        f'<text x="{size / 2}" y="{pad * 0.6:.1f}" text-anchor="middle" font-size="16">Coordinate Plane</text>',
+    ]
+    for v in range(-6, 7):
+        parts.append(f'<line x1="{px(v):.1f}" y1="{lo}" x2="{px(v):.1f}" y2="{hi}" stroke="#e0e0e0"/>')
+        parts.append(f'<line x1="{lo}" y1="{py(v):.1f}" x2="{hi}" y2="{py(v):.1f}" stroke="#e0e0e0"/>')
+        if v % 2 == 0:
+            parts.append(f'<text x="{px(v):.1f}" y="{hi + 16}" text-anchor="middle">{v}</text>')
+            parts.append(f'<text x="{lo - 6}" y="{py(v) + 4:.1f}" text-anchor="end">{v}</text>')
+    parts.append(f'<line x1="{px(0):.1f}" y1="{lo}" x2="{px(0):.1f}" y2="{hi}" stroke="black"/>')
+    parts.append(f'<line x1="{lo}" y1="{py(0):.1f}" x2="{hi}" y2="{py(0):.1f}" stroke="black"/>')
+    parts.append(f'<rect x="{lo}" y="{lo}" width="{hi - lo}" height="{hi - lo}" fill="none" stroke="black"/>')
+    parts.append(f'<text x="{size / 2}" y="{size - 8}" text-anchor="middle">x</text>')
+    parts.append(f'<text x="14" y="{size / 2}" text-anchor="middle">y</text>')
+    for i, (label, (x, y)) in enumerate(points_data.items()):
+        color = _POINT_COLORS[i % len(_POINT_COLORS)]
+        parts.append(f'<circle cx="{px(x):.1f}" cy="{py(y):.1f}" r="5" fill="{color}"/>')
+        parts.append(f'<text x="{px(x) + 7:.1f}" y="{py(y) - 7:.1f}">{escape(str(label))}</text>')
+    parts.append("</svg>")
+    return "".join(parts).encode("utf-8")
 
 
 # ------------------------------
 # Exporters
 # ------------------------------
 
+# WordprocessingML paragraph templates; the w: prefix is bound by WordExporter._append_xml.
+_P_HEADING = '<w:p><w:pPr><w:pStyle w:val="{style}"/></w:pPr><w:r><w:t xml:space="preserve">{text}</w:t></w:r></w:p>'
+_P_LABELED = (
+    '<w:p><w:r><w:rPr><w:b/></w:rPr><w:t xml:space="preserve">{label}</w:t></w:r>'
+    '<w:r><w:t xml:space="preserve">{body}</w:t></w:r></w:p>'
+)
+_P_PLAIN = '<w:p><w:r><w:t xml:space="preserve">{text}</w:t></w:r></w:p>'
+_P_CORRECT = '<w:p><w:r><w:rPr><w:b/></w:rPr><w:t xml:space="preserve">{text} ✓</w:t></w:r></w:p>'
+_R_LINE = '<w:r><w:t xml:space="preserve">{text}</w:t><w:br/></w:r>'
+_P_PAGE_BREAK = '<w:p><w:r><w:br w:type="page"/></w:r></w:p>'
+
+
 class TxtExporter:
     def export(self, questions: List[Dict[str, Any]], filename: str = "assessment_questions.txt",
                title: str = "AI-Generated Quantitative Math Assessment") -> str:
-        chunks: List[str] = []
-        for i, q in enumerate(questions, 1):
-            chunks.append(self._format_question(q, i, title))
-        content = "\n".join(chunks)
-        with open(filename, "w", encoding="utf-8") as f:
-            f.write(content)
+        with open(filename, "w", encoding="utf-8", buffering=1 << 16) as f:
+            for i, q in enumerate(questions, 1):
+                if i > 1:
+                    f.write("\n")
+                f.write(self._format_question(q, i, title))
         return filename
 
     def _format_question(self, q: Dict[str, Any], number: int, title: str) -> str:
-        out: List[str] = []
-        if number == 1:
-            out.append(f"@title {title}")
-            out.append("@description Comprehensive math assessment covering various curriculum topics")
-            out.append("")
-        out.append(f"@question {clean_text(q['question'])}")
-        out.append("@instruction Choose the correct option")
-        out.append(f"@difficulty {clean_text(q['difficulty'])}")
-        out.append(f"@Order {number}")
-        for i, opt in enumerate(q["options"]):
-            tag = "@@option" if i == q["correct_index"] else "@option"
-            out.append(f"{tag} {clean_text(opt)}")
-        out.append(f"@explanation {clean_text(q['explanation'])}")
-        out.append(f"@subject {clean_text(q['subject'])}")
-        out.append(f"@unit {clean_text(q['unit'])}")
-        out.append(f"@topic {clean_text(q['topic'])}")
-        out.append("@plusmarks 1")
-        out.append("")
-        return "\n".join(out)
+        header = (
+            f"@title {title}\n"
+            "@description Comprehensive math assessment covering various curriculum topics\n"
+            "\n"
+        ) if number == 1 else ""
+        options = "\n".join(
+            f"{'@@option' if i == q['correct_index'] else '@option'} {clean_text(opt)}"
+            for i, opt in enumerate(q["options"])
+        )
+        return (
+            f"{header}"
+            f"@question {clean_text(q['question'])}\n"
+            "@instruction Choose the correct option\n"
+            f"@difficulty {clean_text(q['difficulty'])}\n"
+            f"@Order {number}\n"
+            f"{options}\n"
+            f"@explanation {clean_text(q['explanation'])}\n"
+            f"@subject {clean_text(q['subject'])}\n"
+            f"@unit {clean_text(q['unit'])}\n"
+            f"@topic {clean_text(q['topic'])}\n"
+            "@plusmarks 1\n"
+        )
 
 
 class WordExporter:
@@ -66,6 +166,8 @@ class WordExporter:
     """
 
     def __init__(self, filename: str = "math_assessment.docx"):
+        from docx import Document
+
         self.filename = filename
         self.doc = Document()
 
@@ -77,44 +179,55 @@ class WordExporter:
         )
 
     def add_question(self, q: Dict[str, Any], number: int, image_path: Optional[str] = None) -> None:
-        self._add_question_block(q, number)
-        self._add_options(q["options"], q["correct_index"])
-        self._add_details(q)
-        self._add_explanation(q["explanation"])
+        self._append_xml(
+            self._question_block_xml(q, number)
+            + self._options_xml(q["options"], q["correct_index"])
+            + self._details_xml(q)
+            + self._explanation_xml(q["explanation"])
+        )
         if image_path:
+            from docx.shared import Inches
+
             self.doc.add_picture(image_path, width=Inches(4))
         if number > 0:
-            self.doc.add_page_break()
+            self._append_xml(_P_PAGE_BREAK)
+
+    def _append_xml(self, xml: str) -> None:
+        """Parse pre-composed body XML once and insert it before the section properties."""
+        from docx.oxml import parse_xml
+        from docx.oxml.ns import nsdecls
+
+        body = self.doc.element.body
+        anchor = body.sectPr
+        for el in list(parse_xml(f"<w:body {nsdecls('w')}>{xml}</w:body>")):
+            if anchor is not None:
+                anchor.addprevious(el)
+            else:
+                body.append(el)
 
-    def _add_question_block(self, q: Dict[str, Any], number: int) -> None:
-        self.doc.add_heading(f"Question {number}", level=1)
-        p = self.doc.add_paragraph()
-        p.add_run("Question: ").bold = True
-        p.add_run(clean_text(q["question"]))
+    def _question_block_xml(self, q: Dict[str, Any], number: int) -> str:
+        return (
+            _P_HEADING.format(style="Heading1", text=f"Question {number}")
+            + _P_LABELED.format(label="Question: ", body=_xml_text(q["question"]))
+        )
 
-    def _add_options(self, options: List[str], correct_index: int) -> None:
-        self.doc.add_paragraph("Options:", style="Heading 2")
+    def _options_xml(self, options: List[str], correct_index: int) -> str:
+        parts = [_P_HEADING.format(style="Heading2", text="Options:")]
         for idx, opt in enumerate(options):
-            letter = chr(65 + idx)
-            p = self.doc.add_paragraph()
-            if idx == correct_index:
-                p.add_run(f"({letter}) {clean_text(opt)} ").bold = True
-                p.add_run("✓").bold = True
-            else:
-                p.add_run(f"({letter}) {clean_text(opt)}")
-
-    def _add_details(self, q: Dict[str, Any]) -> None:
-        self.doc.add_paragraph("Assessment Details:", style="Heading 2")
-        details = self.doc.add_paragraph()
-        details.add_run(f"Difficulty: {clean_text(q['difficulty'])}\n")
-        details.add_run(f"Subject: {clean_text(q['subject'])}\n")
-        details.add_run(f"Unit: {clean_text(q['unit'])}\n")
-        details.add_run(f"Topic: {clean_text(q['topic'])}\n")
+            text = f"({chr(65 + idx)}) {_xml_text(opt)}"
+            parts.append((_P_CORRECT if idx == correct_index else _P_PLAIN).format(text=text))
+        return "".join(parts)
+
+    def _details_xml(self, q: Dict[str, Any]) -> str:
+        lines = "".join(
+            _R_LINE.format(text=f"{label}: {_xml_text(q[key])}")
+            for label, key in (("Difficulty", "difficulty"), ("Subject", "subject"),
+                               ("Unit", "unit"), ("Topic", "topic"))
+        )
+        return _P_HEADING.format(style="Heading2", text="Assessment Details:") + f"<w:p>{lines}</w:p>"
 
-    def _add_explanation(self, explanation: str) -> None:
-        p = self.doc.add_paragraph()
-        p.add_run("Explanation: ").bold = True
-        p.add_run(clean_text(explanation))
+    def _explanation_xml(self, explanation: str) -> str:
+        return _P_LABELED.format(label="Explanation: ", body=_xml_text(explanation))
 
     def save(self) -> str:
         self.doc.save(self.filename)
@@ -126,11 +239,37 @@ class WordExporter:
 # ------------------------------
 
 class AIQuestionGenerator:
-    def __init__(self, llm_client: Optional[BaseLLMClient] = None) -> None:
+    def __init__(self, llm_client: Optional[BaseLLMClient] = None, seed: Optional[int] = None) -> None:
         self.llm = llm_client
+        # One RNG per generator: reproducible with ``seed`` and independent of the global state.
+        self._rng = random.Random(seed)
+        if self.llm:
+            self.llm.set_prompt_prefix(self._PROMPT_PREFIX)
 
     # ---------- Public API ----------
     def generate_assessment(self, n: int = 2) -> List[Dict[str, Any]]:
+        picks = self._pick_topics(n)
+        drafts = self._generate_llm_batch(picks) if self.llm else [None] * len(picks)
+        return self._finalize(picks, drafts)
+
+    async def agenerate_assessment(self, n: int = 2) -> List[Dict[str, Any]]:
+        """
+        Like generate_assessment, but sends one prompt per question concurrently,
+        for backends that serve parallel requests (e.g. the Ollama server).
+        """
+        picks = self._pick_topics(n)
+        drafts: List[Optional[Dict[str, Any]]] = [None] * len(picks)
+        if self.llm:
+            try:
+                results = await self.llm.agenerate_many([self._build_prompt(*pick) for pick in picks])
+            finally:
+                await self.llm.aclose()
+            for i, res in enumerate(results):
+                if res.ok and res.data:
+                    drafts[i] = self._validate_and_fix_llm(res.data, *picks[i])
+        return self._finalize(picks, drafts)
+
+    def _pick_topics(self, n: int) -> List[Tuple[str, str]]:
         topic_pool = [
             ("Circles (Area, circumference)", "moderate"),
             ("Quadratic Equations & Functions (Finding roots/solutions, graphing)", "moderate"),
@@ -138,13 +277,17 @@ class AIQuestionGenerator:
             ("Fractions, Decimals, & Percents", "moderate"),
             ("Interpreting Variables", "easy"),
         ]
-        picks = random.sample(topic_pool, k=min(n, len(topic_pool)))
+        picks = self._rng.sample(topic_pool, k=min(n, len(topic_pool)))
         while len(picks) < n:  # if n > pool size
-            picks.append(random.choice(topic_pool))
+            picks.append(self._rng.choice(topic_pool))
+        return picks
 
+    def _finalize(self, picks: List[Tuple[str, str]],
+                  drafts: List[Optional[Dict[str, Any]]]) -> List[Dict[str, Any]]:
         questions: List[Dict[str, Any]] = []
-        for topic, diff in picks:
-            q = self.generate_question(topic, diff)
+        for (topic, diff), q in zip(picks, drafts):
+            if q is None:
+                q = self._fallback_by_topic(topic, diff)
             q["options"] = self._ensure_five(q["options"])
             if not (0 <= int(q["correct_index"]) < 5):
                 q["correct_index"] = 0
@@ -160,24 +303,61 @@ class AIQuestionGenerator:
                 return self._validate_and_fix_llm(result.data, topic, difficulty)
         return self._fallback_by_topic(topic, difficulty)
 
+    def _generate_llm_batch(self, picks: List[Tuple[str, str]]) -> List[Optional[Dict[str, Any]]]:
+        """
+        Ask for all questions in one LLM call; re-request per item only for
+        entries the batched answer did not yield. ``None`` means use the fallback.
+        """
+        drafts: List[Optional[Dict[str, Any]]] = [None] * len(picks)
+        result = self.llm.generate_array(self._build_batch_prompt(picks), max_new_tokens=768 * len(picks))
+        if result.ok and result.items:
+            for i, data in enumerate(result.items[: len(picks)]):
+                if data is not None:
+                    drafts[i] = self._validate_and_fix_llm(data, *picks[i])
+
+        missing = [i for i, q in enumerate(drafts) if q is None]
+        if missing:
+            results = self.llm.generate_many([self._build_prompt(*picks[i]) for i in missing])
+            for i, res in zip(missing, results):
+                if res.ok and res.data:
+                    drafts[i] = self._validate_and_fix_llm(res.data, *picks[i])
+        return drafts
+
     # ---------- Prompting ----------
+    # Every prompt starts with this invariant block and only the trailing
+    # topic/difficulty lines vary, so backends can reuse the prefix's KV cache.
+    _SCHEMA = {
+        "question": "string (use LaTeX if needed)",
+        "options": ["string", "string", "string", "string", "string"],
+        "correct_index": "integer (0-4)",
+        "explanation": "string (step-by-step; LaTeX allowed)",
+    }
+    _PROMPT_PREFIX = (
+        "You write multiple-choice math questions as JSON ONLY (no extra text).\n"
+        "Requirements:\n"
+        "- Use LaTeX for math (e.g., $x^2$, \\frac{a}{b}).\n"
+        "- Provide EXACTLY 5 unique options in an array.\n"
+        "- Set correct_index to the correct option's index (0-4).\n"
+        "- Keys must be: question, options, correct_index, explanation.\n"
+        f"Each question is a compact JSON object matching this schema: {_SCHEMA}\n\n"
+    )
+
     def _build_prompt(self, topic: str, difficulty: str) -> str:
-        schema = {
-            "question": "string (use LaTeX if needed)",
-            "options": ["string", "string", "string", "string", "string"],
-            "correct_index": "integer (0-4)",
-            "explanation": "string (step-by-step; LaTeX allowed)",
-        }
         return (
-            "Generate ONE multiple-choice math question as JSON ONLY (no extra text).\n"
+            f"{self._PROMPT_PREFIX}"
+            "Generate ONE question and return its JSON object.\n"
             f"Topic: {topic}\n"
             f"Difficulty: {difficulty}\n"
-            "Requirements:\n"
-            "- Use LaTeX for math (e.g., $x^2$, \\frac{a}{b}).\n"
-            "- Provide EXACTLY 5 unique options in an array.\n"
-            "- Set correct_index to the correct option's index (0-4).\n"
-            "- Keys must be: question, options, correct_index, explanation.\n\n"
-            f"Return a compact JSON matching this schema: {schema}\n"
+        )
+
+    def _build_batch_prompt(self, picks: List[Tuple[str, str]]) -> str:
+        n = len(picks)
+        items = "".join(f"{i}. Topic: {topic}; Difficulty: {diff}\n" for i, (topic, diff) in enumerate(picks, 1))
+        return (
+            f"{self._PROMPT_PREFIX}"
+            f"Generate {n} questions and return them as a JSON array of {n} objects, "
+            "one per item below, in the same order.\n"
+            f"{items}"
         )
 
     # ---------- Validation / Repair ----------
@@ -211,20 +391,27 @@ class AIQuestionGenerator:
         }
 
     # ---------- Curriculum mapping ----------
+    # Keyword -> (subject, unit, topic); first keyword found in the topic wins.
+    _CURRICULUM: Dict[str, Tuple[str, str, str]] = {
+        "circle": ("Quantitative Math", "Geometry and Measurement", "Circles (Area, circumference)"),
+        "quadratic": ("Quantitative Math", "Algebra",
+                      "Quadratic Equations & Functions (Finding roots/solutions, graphing)"),
+        "coordinate": ("Quantitative Math", "Geometry and Measurement", "Coordinate Geometry"),
+        "fraction": ("Quantitative Math", "Numbers and Operations", "Fractions, Decimals, & Percents"),
+        "percent": ("Quantitative Math", "Numbers and Operations", "Fractions, Decimals, & Percents"),
+        "interpreting variables": ("Quantitative Math", "Algebra", "Interpreting Variables"),
+        "linear": ("Quantitative Math", "Algebra", "Interpreting Variables"),
+    }
+    _CURRICULUM_DEFAULT = ("Quantitative Math", "Problem Solving", "Algebra")
+    # The same mapping as ready-made question fields for the fallback generators.
+    _FIELDS = {key: {"subject": s, "unit": u, "topic": t} for key, (s, u, t) in _CURRICULUM.items()}
+
     def _map_curriculum(self, topic: str) -> Tuple[str, str, str]:
         t = topic.lower()
-        if "circle" in t:
-            return ("Quantitative Math", "Geometry and Measurement", "Circles (Area, circumference)")
-        if "quadratic" in t:
-            return ("Quantitative Math", "Algebra",
-                    "Quadratic Equations & Functions (Finding roots/solutions, graphing)")
-        if "coordinate" in t:
-            return ("Quantitative Math", "Geometry and Measurement", "Coordinate Geometry")
-        if "fraction" in t or "percent" in t:
-            return ("Quantitative Math", "Numbers and Operations", "Fractions, Decimals, & Percents")
-        if "interpreting variables" in t or "linear" in t:
-            return ("Quantitative Math", "Algebra", "Interpreting Variables")
-        return ("Quantitative Math", "Problem Solving", "Algebra")
+        for key, mapping in self._CURRICULUM.items():
+            if key in t:
+                return mapping
+        return self._CURRICULUM_DEFAULT
 
     # ---------- Fallback generators ----------
     def _fallback_by_topic(self, topic: str, difficulty: str) -> Dict[str, Any]:
@@ -249,15 +436,21 @@ class AIQuestionGenerator:
                 seen.add(s)
             if len(uniq) == 5:
                 break
-        while len(uniq) < 5:
-            filler = str(random.randint(1, 99))
-            if filler not in seen:
-                uniq.append(filler)
-                seen.add(filler)
-        return uniq[:5]
+        needed = 5 - len(uniq)
+        if needed > 0:
+            uniq.extend(self._rng.sample([str(x) for x in range(1, 100) if str(x) not in seen], needed))
+        return uniq
+
+    def _place_answer(self, options: List[Any]) -> Tuple[List[Any], int]:
+        """Shuffle options whose first entry is the answer; return them with the answer's index."""
+        rest = options[1:]
+        self._rng.shuffle(rest)
+        idx = self._rng.randrange(len(options))
+        rest.insert(idx, options[0])
+        return rest, idx
 
     def _gen_circle(self, difficulty: str) -> Dict[str, Any]:
-        r = random.randint(3, 12)
+        r = self._rng.randint(3, 12)
         area = r * r
         correct = f"${area}\\pi$"
         options = self._ensure_five([
@@ -267,23 +460,19 @@ class AIQuestionGenerator:
             f"${2*area}\\pi$",
             f"${max(1, area//2)}\\pi$",
         ])
-        idx = options.index(correct) if correct in options else 0
+        idx = 0  # _ensure_five keeps first-seen order, so the answer stays first
         return {
-            "question": f"A circle has a radius of {r} units. What is the area of the circle?",
+            "question": _CIRCLE_Q.format_map({"r": r}),
             "options": options,
             "correct_index": idx,
-            "explanation": f"Area formula: $A=\\pi r^2$. With $r={r}$, $A=\\pi\\cdot {r}^2={area}\\pi$ square units.",
-            "subject": "Quantitative Math",
-            "unit": "Geometry and Measurement",
-            "topic": "Circles (Area, circumference)",
+            "explanation": _CIRCLE_EXPL.format_map({"r": r, "area": area}),
+            **self._FIELDS["circle"],
             "difficulty": difficulty,
             "has_image": False,
         }
 
     def _gen_quadratic(self, difficulty: str) -> Dict[str, Any]:
-        a, b = random.sample(range(-6, 7), 2)
-        while b == a:
-            a, b = random.sample(range(-6, 7), 2)
+        a, b = self._rng.sample(range(-6, 7), 2)
         B = -(a + b)
         C = a * b
         eq = f"$x^2 {'+' if B>=0 else '-'} {abs(B)}x {'+' if C>=0 else '-'} {abs(C)}=0$"
@@ -295,88 +484,72 @@ class AIQuestionGenerator:
             f"$x={a}$ and $x={b+2}$",
             f"$x={a-1}$ and $x={b}$",
         ])
-        idx = options.index(correct) if correct in options else 0
+        idx = 0  # _ensure_five keeps first-seen order, so the answer stays first
         return {
-            "question": f"If {eq}, what are all possible values of $x$?",
+            "question": _QUADRATIC_Q.format_map({"eq": eq}),
             "options": options,
             "correct_index": idx,
-            "explanation": f"Factor: $(x-{a})(x-{b})=0$ so $x={a}$ or $x={b}$.",
-            "subject": "Quantitative Math",
-            "unit": "Algebra",
-            "topic": "Quadratic Equations & Functions (Finding roots/solutions, graphing)",
+            "explanation": _QUADRATIC_EXPL.format_map({"a": a, "b": b}),
+            **self._FIELDS["quadratic"],
             "difficulty": difficulty,
             "has_image": False,
         }
 
     def _gen_coordinate(self, difficulty: str) -> Dict[str, Any]:
-        target_x = random.randint(-5, 5)
-        target_y = random.randint(-5, 5)
-        pts: List[Tuple[int, int]] = [(target_x, target_y)]
-        xs = {target_x}
-        while len(pts) < 5:
-            x = random.randint(-5, 5)
-            if x in xs:
-                continue
-            y = random.randint(-5, 5)
-            pts.append((x, y))
-            xs.add(x)
-        random.shuffle(pts)
+        # Five distinct x values (target first) and any five y values.
+        xs = self._rng.sample(range(-5, 6), 5)
+        ys = [self._rng.randint(-5, 5) for _ in range(5)]
+        target_x, target_y = xs[0], ys[0]
+        pts, idx = self._place_answer(list(zip(xs, ys)))
         letters = ["A", "B", "C", "D", "E"]
-        idx = pts.index((target_x, target_y))
         answer_letter = letters[idx]
         return {
-            "question": f"Which point on the coordinate plane has an $x$-coordinate of {target_x}?",
+            "question": _COORD_Q.format_map({"x": target_x}),
             "options": letters.copy(),
             "correct_index": idx,
-            "explanation": f"Point {answer_letter} is at $({target_x}, {target_y})$ so its $x$-coordinate is {target_x}.",
-            "subject": "Quantitative Math",
-            "unit": "Geometry and Measurement",
-            "topic": "Coordinate Geometry",
+            "explanation": _COORD_EXPL.format_map({"letter": answer_letter, "x": target_x, "y": target_y}),
+            **self._FIELDS["coordinate"],
             "difficulty": difficulty,
             "has_image": True,
             "points_data": {letters[i]: pts[i] for i in range(5)},
         }
 
     def _gen_fraction(self, difficulty: str) -> Dict[str, Any]:
-        total = random.randint(40, 120)
-        percentage = random.choice([25, 30, 40, 50, 60, 75, 80])
-        category = random.choice(["wearing glasses", "playing sports", "taking music lessons"])
+        total = self._rng.randint(40, 120)
+        percentage = self._rng.choice([25, 30, 40, 50, 60, 75, 80])
+        category = self._rng.choice(["wearing glasses", "playing sports", "taking music lessons"])
         correct = (total * percentage) // 100
         wrongs = list({correct + d for d in [-10, -5, 5, 10] if correct + d > 0})
         options = self._ensure_five([str(correct)] + [str(w) for w in wrongs])
-        random.shuffle(options)
-        idx = options.index(str(correct))
+        options, idx = self._place_answer(options)
         return {
-            "question": f"In a group of {total} students, {percentage}% are {category}. How many students are {category}?",
+            "question": _FRACTION_Q.format_map({"total": total, "pct": percentage, "category": category}),
             "options": options,
             "correct_index": idx,
-            "explanation": f"Compute {percentage}% of {total}: $\\frac{{{percentage}}}{{100}}\\times {total}={correct}$.",
-            "subject": "Quantitative Math",
-            "unit": "Numbers and Operations",
-            "topic": "Fractions, Decimals, & Percents",
+            "explanation": _FRACTION_EXPL.format_map({"pct": percentage, "total": total, "answer": correct}),
+            **self._FIELDS["fraction"],
             "difficulty": difficulty,
             "has_image": False,
         }
 
     def _gen_linear(self, difficulty: str) -> Dict[str, Any]:
-        a = random.randint(2, 10)
-        c = random.randint(1, a - 1)
-        d = random.randint(5, 20)
-        x_target = random.randint(2, 5)
+        a = self._rng.randint(2, 10)
+        c = self._rng.randint(1, a - 1)
+        d = self._rng.randint(5, 20)
+        x_target = self._rng.randint(2, 5)
         b = d - x_target * (a - c)
         expr = f"${a}x {'+' if b>=0 else '-'} {abs(b)} = {c}x + {d}$"
         wrongs = [x_target + 1, max(1, x_target - 1), x_target + 2, x_target * 2]
         options = self._ensure_five([str(x_target)] + [str(w) for w in wrongs])
-        random.shuffle(options)
-        idx = options.index(str(x_target))
+        options, idx = self._place_answer(options)
         return {
-            "question": f"If {expr}, what is the value of $x$?",
+            "question": _LINEAR_Q.format_map({"expr": expr}),
             "options": options,
             "correct_index": idx,
-            "explanation": f"${a}x-{c}x={d}-{b}$ so ${(a-c)}x={d-b}$, hence $x={x_target}$.",
-            "subject": "Quantitative Math",
-            "unit": "Algebra",
-            "topic": "Interpreting Variables",
+            "explanation": _LINEAR_EXPL.format_map(
+                {"a": a, "b": b, "c": c, "d": d, "k": a - c, "rhs": d - b, "x": x_target}
+            ),
+            **self._FIELDS["linear"],
             "difficulty": difficulty,
             "has_image": False,
         }
@@ -385,19 +558,36 @@ class AIQuestionGenerator:
     def create_graph_image(self, question_data: Dict[str, Any], filename: str) -> Optional[str]:
         if not question_data.get("has_image") or "points_data" not in question_data:
             return None
-        fig, ax = plt.subplots(figsize=(6, 6))
+        cairosvg = _load_cairosvg()
+        if cairosvg is None:
+            return self._create_graph_image_mpl(question_data, filename)
+        svg = _render_coord_svg(question_data["points_data"])
+        cairosvg.svg2png(bytestring=svg, write_to=filename, output_width=900)
+        return filename
+
+    def _create_graph_image_mpl(self, question_data: Dict[str, Any], filename: str) -> str:
+        """Matplotlib rendering, used when cairosvg cannot rasterize the SVG."""
+        import numpy as np
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        # Plain Figure + Agg canvas: no pyplot state machine, nothing to close.
+        fig = Figure(figsize=(6, 6))
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot(111)
         ax.grid(True, alpha=0.3)
         ax.set_xlim(-6, 6)
         ax.set_ylim(-6, 6)
         ax.axhline(y=0, color="k", linewidth=0.7)
         ax.axvline(x=0, color="k", linewidth=0.7)
-        for label, (x, y) in question_data["points_data"].items():
-            ax.plot(x, y, marker="o")
+        labels, coords = zip(*question_data["points_data"].items())
+        pts = np.array(coords)
+        ax.scatter(pts[:, 0], pts[:, 1], marker="o", c=[f"C{i}" for i in range(len(labels))], zorder=3)
+        for label, (x, y) in zip(labels, coords):
             ax.annotate(label, (x, y), xytext=(6, 6), textcoords="offset points")
         ax.set_xlabel("x")
         ax.set_ylabel("y")
         ax.set_title("Coordinate Plane")
         fig.tight_layout()
         fig.savefig(filename, dpi=150, bbox_inches="tight")
-        plt.close(fig)
         return filename
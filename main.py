@@ -2,8 +2,11 @@
 from __future__ import annotations
 
 import argparse
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict
 
-from llm_clients import HFClient, OllamaClient, BaseLLMClient
+from llm_clients import OllamaClient, BaseLLMClient, CachingLLMClient
 from llm_generator import AIQuestionGenerator, TxtExporter, WordExporter
 
 
@@ -13,36 +16,57 @@ def main() -> None:
     parser.add_argument("--llm", choices=["hf", "ollama", "none"], default="ollama", help="LLM backend")
     parser.add_argument("--hf_model", type=str, default="mistralai/Mistral-7B-Instruct-v0.2", help="HF model name")
     parser.add_argument("--ollama_model", type=str, default="mistral:7b", help="Ollama model name")
+    parser.add_argument("--ollama_parallel", type=int, default=4,
+                        help="Concurrent Ollama requests (match the server's OLLAMA_NUM_PARALLEL)")
     parser.add_argument("--title", type=str, default="AI-Generated Quantitative Math Assessment",
                         help="Assessment title")
+    parser.add_argument("--cache", action="store_true", help="Reuse cached LLM responses for identical prompts")
+    parser.add_argument("--cache_path", type=str, default=".llm_cache.sqlite3", help="LLM response cache file")
     args = parser.parse_args()
+    if args.ollama_parallel < 1:
+        parser.error("--ollama_parallel must be at least 1")
 
     # Initialize client
     client: BaseLLMClient | None
     if args.llm == "hf":
+        from llm_clients import HFClient
+
         client = HFClient(model=args.hf_model)
     elif args.llm == "ollama":
-        client = OllamaClient(model=args.ollama_model)
+        client = OllamaClient(model=args.ollama_model, num_parallel=args.ollama_parallel)
     else:
         client = None
+    if client is not None and args.cache:
+        client = CachingLLMClient(client, path=args.cache_path)
 
     print("🚀 Generating Math Assessment Questions...")
     gen = AIQuestionGenerator(llm_client=client)
 
-    questions = gen.generate_assessment(args.num)
+    if args.llm == "ollama":
+        # The Ollama server handles parallel requests: send one prompt per question at once.
+        questions = asyncio.run(gen.agenerate_assessment(args.num))
+    else:
+        questions = gen.generate_assessment(args.num)
+
+    # Render graphs in the background while the TXT export and the DOCX text
+    # blocks are built; rasterizing (cairo, or the Agg fallback) runs in native code.
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        images: Dict[int, Future] = {
+            i: pool.submit(gen.create_graph_image, q, f"question_{i}_graph.png")
+            for i, q in enumerate(questions, 1)
+            if q.get("has_image") and "points_data" in q
+        }
 
-    # TXT output (HR-required tag format)
-    txt_path = TxtExporter().export(questions, filename="assessment_questions.txt", title=args.title)
+        # TXT output (HR-required tag format)
+        txt_path = TxtExporter().export(questions, filename="assessment_questions.txt", title=args.title)
 
-    # DOCX output with images (generated and embedded automatically)
-    doc = WordExporter(filename="math_assessment.docx")
-    doc.add_title()
-    for i, q in enumerate(questions, 1):
-        img_path = None
-        if q.get("has_image") and "points_data" in q:
-            img_path = gen.create_graph_image(q, f"question_{i}_graph.png")
-        doc.add_question(q, i, image_path=img_path)
-    doc_path = doc.save()
+        # DOCX output with images (generated and embedded automatically)
+        doc = WordExporter(filename="math_assessment.docx")
+        doc.add_title()
+        for i, q in enumerate(questions, 1):
+            img_path = images[i].result() if i in images else None
+            doc.add_question(q, i, image_path=img_path)
+        doc_path = doc.save()
 
     print("✅ Assessment generation completed!")
     print(f"📝 Formatted questions: {txt_path}")